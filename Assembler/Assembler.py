@@ -1,8 +1,12 @@
 import os
 import sys
 import re
+import stat
+import hashlib
+import tempfile
 
 from ErrorCodes import *
+from Expression import *
 
 
 class Assembler(object):
@@ -20,8 +24,11 @@ class Assembler(object):
     # REGEX to match the DEPTH definition
     DEPTH_DEF_REGEX = re.compile('DEPTH\s+(\d+)' + TRAIL_SPACE_COMMENT)
     
+    # REGEX string to match a constant expression, see Expression
+    EXPR_STR = '([\w$(][\w$()+\-*<>&|\s]*?)'
+    
     # REGEX to match a define (.define) statement
-    DEFINE_REGEX = re.compile('\.define\s+([a-zA-Z_$][a-zA-Z_$0-9]*)\s+((0|0b|0x)?\w+)' + 
+    DEFINE_REGEX = re.compile('\.define\s+([a-zA-Z_$][a-zA-Z_$0-9]*)\s+' + EXPR_STR + 
         TRAIL_SPACE_COMMENT)
     
     # REGEX string to match a label only
@@ -36,12 +43,10 @@ class Assembler(object):
         '(mv|add|sub|ld|st|and)\s+(r[0-7]|pc),\s*\[*(r[0-7]|pc)\]*' + TRAIL_SPACE_COMMENT)
     # type 2 is an instruction with Op2 = #Data
     INSTR_TYPE2_REGEX = re.compile('(' + LABEL_REGEX_STR + ')?\s*' + 
-        '(mv|mvt|add|sub|and)\s+(r[0-7]|pc),\s*#*(((0|0b|0x)?\w+)|[a-zA-Z_$][a-zA-Z_$0-9]*)+' +
-        TRAIL_SPACE_COMMENT)
+        '(mv|mvt|add|sub|and)\s+(r[0-7]|pc),\s*#*' + EXPR_STR + TRAIL_SPACE_COMMENT)
     # type 3 is a branch instruction
     INSTR_TYPE3_REGEX = re.compile('(' + LABEL_REGEX_STR + ')?\s*' + 
-        '(b(eq|ne|cc|cs)?)\s+#*(((0|0b|0x)?\w+)|[a-zA-Z_$][a-zA-Z_$0-9]*)+' + 
-        TRAIL_SPACE_COMMENT)
+        '(b(eq|ne|cc|cs)?)\s+#*' + EXPR_STR + TRAIL_SPACE_COMMENT)
     # error check for an instruction that is not ld|st but Op2 = [rY]
     INSTR_TYPE1_CHK_REGEX = re.compile('(' + LABEL_REGEX_STR + ')?\s*' + 
         '(mv|add|sub|and)\s+(r[0-7]|pc),\s*\[(r[0-7]|pc)\]' + TRAIL_SPACE_COMMENT)
@@ -51,6 +56,16 @@ class Assembler(object):
     WORD_DIR_REGEX = re.compile('(' + LABEL_REGEX_STR + ')?\s*' + '(.word)\s+((0|0b|0x)?\w+)' + 
         TRAIL_SPACE_COMMENT)
     
+    # REGEX to match a variant, NAME: SYMBOL=VALUE, SYMBOL=VALUE, ...
+    VARIANT_REGEX = re.compile('([\w$.\-]+)\s*:\s*(.*?)' + TRAIL_SPACE_COMMENT)
+    
+    # REGEX to match one SYMBOL=VALUE override of a variant
+    OVERRIDE_REGEX = re.compile('\s*([a-zA-Z_$][a-zA-Z_$0-9]*)\s*=\s*' + EXPR_STR + '\s*$')
+    
+    # Errors in the value of a define or an immediate, which the values of a variant can fix
+    VALUE_ERRORS = (ErrorCodes.BIG_IMMED, ErrorCodes.BIG_DEFINE, ErrorCodes.IMMED_LABEL_NF, 
+        ErrorCodes.BAD_IMMED, ErrorCodes.BIG_BRANCH)
+    
     # Max integers 
     MAX_INT_16U = 65535     # maximum size of an integer (16 bits)
     MAX_INT_IMM = 0x1FF     # maximum size of immediate data
@@ -82,12 +97,14 @@ class Assembler(object):
         # Used for printing comments at the end of a line of machine code
     COND_VAL_TO_STR = ['  ', 'eq', 'ne', 'cc', 'cs', '', '', '']
     
-    def __init__(self, in_filename, out_filename):
+    def __init__(self, in_filename, out_filename, update_only=False, dep_filename=None):
         """
         Initializes the assembler.
         Args:
             in_filename: The input filename.
             out_filename: The output filname.
+            update_only: If True, output files whose content is unchanged are not rewritten.
+            dep_filename: If given, a make-style dependency file is written to this name.
         """
         # Store the input filename
         self.in_filename = in_filename
@@ -97,6 +114,18 @@ class Assembler(object):
             out_filename = 'a.mif'
         self.out_filename = out_filename
         
+        # Leave output files untouched when their content would not change
+        self.update_only = update_only
+        
+        # Store the dependency filename, None if no depfile is wanted
+        self.dep_filename = dep_filename
+        
+        # All files read to produce the output, listed in the depfile
+        self.input_filenames = [in_filename]
+        
+        # All output files, the targets of the depfile
+        self.out_filenames = []
+        
         # The lines of the input file will be stored here
         self.lines = []
         
@@ -107,9 +136,29 @@ class Assembler(object):
         # A value of 0 indicates data
         self.is_inst = []
         
+        # The input line number each machine code word was assembled from
+        self.instr_num_to_line = []
+        
         # Maps labels and defines to (line) numbers
         self.symbol_def_to_num = {}
         
+        # Maps defines to their (Expression, line) until they are resolved
+        self.define_to_expr = {}
+        
+        # Every instruction with an immediate operand, kept so that the instruction can be
+        # encoded again for other define values. Each entry is the tuple
+        # (instruction number, line, encode method, instr, register or condition, Expression)
+        self.immediate_operands = []
+        
+        # When True, value errors do not stop the assembly. The defines and instructions with
+        # such errors are recorded instead, so that each variant can evaluate them again.
+        self.defer_value_errors = False
+        
+        # Defines whose value could not be resolved, and instruction numbers whose immediate
+        # could not be encoded, while value errors were deferred
+        self.bad_defines = set()
+        self.bad_operands = set()
+        
         # Width bits (only 16 is currently supported)
         self.width_bits = 16
         
@@ -140,10 +189,154 @@ class Assembler(object):
         """
         # validate and parse the in and out filenames.
         self.__validate_out_filename()
-        width = 0
-        depth = 0
-        line = 0
         
+        if self.__assemble_lines():
+            # Output the MIF file
+            self.__output_file(self.out_filename)
+            self.__output_depfile()
+    
+    
+    def assemble_variants(self, variants):
+        """
+        Assembles the input file once for each variant, a set of values that replace some of
+        the .define values (and DEPTH). The input file is parsed once; each variant then only
+        re-evaluates the defines that depend on its overrides and re-encodes the instructions
+        that use them. Each variant is written to the output filename with _<name> appended,
+        and an error in one variant does not stop the others. Value errors of the input file
+        itself, such as a define that is too large, are only reported for the variants that
+        do not override them.
+        Args:
+            variants: A list of (name, {symbol: value string}) pairs, see parse_variant.
+        """
+        # validate and parse the in and out filenames.
+        self.__validate_out_filename()
+        
+        # Two variants with the same name would write the same output file
+        duplicate = self.find_duplicate_variant(variants)
+        if duplicate is not None:
+            print('ERROR: variant ' + duplicate + ' is defined more than once')
+            return
+        
+        self.defer_value_errors = True
+        success = self.__assemble_lines()
+        self.defer_value_errors = False
+        if not success:
+            return
+        
+        # Keep the state of the plain assembly, each variant starts from it
+        base_state = (self.symbol_def_to_num, self.define_to_expr, self.depth_words, 
+            self.machine_instructions)
+        
+        for (name, overrides) in variants:
+            error = self.__apply_overrides(overrides)
+            
+            if error is not ErrorCodes.NO_ERROR:
+                print('Variant ' + name + ': ' + ErrorCodes.get_error_message(error, self.line, 
+                    self.depth_words, self.curr_instr_num))
+            else:
+                self.__output_file(self.__variant_filename(name))
+            
+            (self.symbol_def_to_num, self.define_to_expr, self.depth_words, 
+                self.machine_instructions) = base_state
+        #ENDFOR
+        
+        self.__output_depfile()
+    
+    
+    def read_variant_file(self, filename):
+        """
+        Reads variants from a file with one variant per line, in the format accepted by
+        parse_variant. Blank lines and // comments are ignored. The file is added to the
+        inputs listed in the depfile.
+        Args:
+            filename: The variant filename.
+        Returns:
+            [(str, {str: str})]: The variants, in the order of the file.
+        """
+        if not filename.strip() or not os.path.isfile(filename):
+            print('Variant file: ' + filename + ' is invalid')
+            sys.exit()
+        
+        variants = []
+        with open(filename, 'r') as variant_file:
+            for (line_num, line) in enumerate(variant_file.read().splitlines(), 1):
+                line = line.strip()
+                if line == "" or self.__is_comment(line):
+                    continue
+                
+                variant = self.parse_variant(line)
+                if variant is None:
+                    print("Error: can't parse variant on line " + str(line_num) + ' of ' + 
+                        filename)
+                    sys.exit()
+                variants.append(variant)
+        
+        self.input_filenames.append(filename)
+        return variants
+    
+    
+    @staticmethod
+    def find_duplicate_variant(variants):
+        """
+        Finds a variant name that is used more than once.
+        Args:
+            variants: A list of (name, {symbol: value string}) pairs.
+        Returns:
+            str: The first repeated name, None if all names are different.
+        """
+        names = set()
+        for (name, overrides) in variants:
+            if name in names:
+                return name
+            names.add(name)
+        
+        return None
+    
+    
+    @staticmethod
+    def parse_variant(text):
+        """
+        Parses a variant of the form NAME: SYMBOL=VALUE, SYMBOL=VALUE, ... where each VALUE
+        is an expression, as for .define.
+        Args:
+            text: The variant string.
+        Returns:
+            (str, {str: str}): The variant name and its overrides, None if text is malformed.
+        """
+        match = Assembler.VARIANT_REGEX.match(text.strip())
+        if match is None:
+            return None
+        
+        overrides = {}
+        if match.group(2).strip():
+            for override in match.group(2).split(','):
+                override_match = Assembler.OVERRIDE_REGEX.match(override)
+                if override_match is None:
+                    return None
+                overrides[override_match.group(1)] = override_match.group(2)
+        
+        return match.group(1), overrides
+    
+    
+    def map_lines(self):
+        """
+        Runs both passes over the input file without writing any output, to find the input
+        line that each word of memory was assembled from.
+        Returns:
+            [int]: The input line number of each word, None if the input file has errors.
+        """
+        if not self.__assemble_lines():
+            return None
+        
+        return self.instr_num_to_line
+    
+    
+    def __assemble_lines(self):
+        """
+        Runs both passes over the input file and prints the error, if any.
+        Returns:
+            Boolean: True on success.
+        """
         # Preprocess by finding the labels
         error = self.__find_labels()
             
@@ -151,17 +344,122 @@ class Assembler(object):
             # Error in preprocess.
             print(ErrorCodes.get_error_message(error, self.line, self.depth_words, 
                 self.curr_instr_num))
-        else:
-            # Parse the lines of the input file
-            error = self.__parse_lines()
+            return False
+        
+        # Parse the lines of the input file
+        error = self.__parse_lines()
 
-            if error is not ErrorCodes.NO_ERROR:
-                # Error in processing
-                print(ErrorCodes.get_error_message(error, self.line, self.depth_words, 
-                    self.curr_instr_num))
+        if error is not ErrorCodes.NO_ERROR:
+            # Error in processing
+            print(ErrorCodes.get_error_message(error, self.line, self.depth_words, 
+                self.curr_instr_num))
+            return False
+        
+        return True
+    
+    
+    def __apply_overrides(self, overrides):
+        """
+        Replaces the symbol values, depth and machine instructions with those of a variant.
+        Only the defines that depend on an overridden symbol are evaluated again, and only
+        the instructions that use one of those defines are encoded again. The replaced
+        attributes are new objects, so the caller can restore the previous ones.
+        Args:
+            overrides: Maps symbols to value strings.
+        Returns:
+            int: ErrorCodes.NO_ERROR on success, some error code on failure.
+        """
+        define_to_expr = dict(self.define_to_expr)
+        changed = set()
+        depth_changed = False
+        
+        for (symbol, value_str) in overrides.items():
+            if symbol == 'DEPTH':
+                try:
+                    depth = Expression(value_str).evaluate({})
+                except ExpressionError:
+                    return ErrorCodes.DEPTH_ERROR
+                
+                # Depth must be a power of 2
+                if depth <= 0 or depth % 2 != 0:
+                    return ErrorCodes.DEPTH_ERROR
+                self.depth_words = depth
+                depth_changed = True
+            elif symbol not in self.define_to_expr:
+                return ErrorCodes.OVERRIDE_NF
             else:
-                # Output the MIF file
-                self.__output_file()
+                line = self.define_to_expr[symbol][1]
+                self.line = line
+                try:
+                    define_to_expr[symbol] = (Expression(value_str), line)
+                except ExpressionError as e:
+                    return e.error_code
+                changed.add(symbol)
+        #ENDFOR
+        
+        # Forget the values of the overridden defines and everything that depends on them,
+        # then resolve those again, along with the defines the input file got wrong
+        affected = self.__find_dependents(changed | self.bad_defines)
+        self.define_to_expr = define_to_expr
+        self.symbol_def_to_num = dict((symbol, num) for (symbol, num) in 
+            self.symbol_def_to_num.items() if symbol not in affected)
+        
+        error = self.__resolve_defines()
+        if error is not ErrorCodes.NO_ERROR:
+            return error
+        
+        # Encode the affected instructions, and those the input file got wrong, again. A new
+        # depth changes the range of branches.
+        self.machine_instructions = list(self.machine_instructions)
+        
+        for (instr_num, line, encode, instr, field, expr) in self.immediate_operands:
+            if not affected.isdisjoint(expr.symbols) or instr_num in self.bad_operands or (
+                    depth_changed and encode == self.__encode_type3_instruction):
+                self.line = line
+                (error, sub_mif) = encode(instr, field, expr)
+                if error is not ErrorCodes.NO_ERROR:
+                    return error
+                self.machine_instructions[instr_num] = sub_mif[0]
+        #ENDFOR
+        
+        return ErrorCodes.NO_ERROR
+    
+    
+    def __find_dependents(self, symbols):
+        """
+        Finds the defines that depend on the given symbols, directly or through other
+        defines.
+        Args:
+            symbols: A set of symbol names.
+        Returns:
+            set: The given symbols and all the defines that depend on them.
+        """
+        # Maps each symbol to the defines that use it
+        symbol_to_users = {}
+        for (define, (expr, line)) in self.define_to_expr.items():
+            for symbol in expr.symbols:
+                symbol_to_users.setdefault(symbol, []).append(define)
+        
+        found = set(symbols)
+        pending = list(symbols)
+        while pending:
+            for user in symbol_to_users.get(pending.pop(), []):
+                if user not in found:
+                    found.add(user)
+                    pending.append(user)
+        
+        return found
+    
+    
+    def __variant_filename(self, name):
+        """
+        Derives the output filename of a variant.
+        Args:
+            name: The variant name.
+        Returns:
+            str: The output filename with _<name> inserted before the .mif extension.
+        """
+        return self.out_filename[:-len('.mif')] + '_' + name + '.mif'
     
     
     def __find_labels(self):
@@ -195,19 +493,21 @@ class Assembler(object):
                     # Line is a define statement
                     match = self.DEFINE_REGEX.match(line)
                     
-                    # Get the symbol and the number
+                    # Get the symbol and the expression, which is evaluated once all labels
+                    # and defines are known
                     symbol = match.group(1)
-                    num = int(match.group(2), 0)
+                    try:
+                        expr = Expression(match.group(2))
+                    except ExpressionError as e:
+                        return e.error_code
                     
                     if symbol == 'DEPTH':
                         return ErrorCodes.DEPTH_DEFINE
-                    elif symbol in self.symbol_def_to_num:
+                    elif self.__is_symbol_defined(symbol):
                         return ErrorCodes.DEFINE_REDEF
-                    elif self.__is_number_too_large(num):
-                        return ErrorCodes.BIG_DEFINE
                     else:
-                        # Add the mapping to the symbol -> value mapping
-                        self.symbol_def_to_num[symbol] = num
+                        # Add the mapping to the symbol -> expression mapping
+                        self.define_to_expr[symbol] = (expr, self.line)
                 elif self.LABEL_REGEX.match(line):
                     # Line is only a label
                     match = self.LABEL_REGEX.match(line)
@@ -215,7 +515,7 @@ class Assembler(object):
                     
                     if label == 'DEPTH':
                         return ErrorCodes.DEPTH_DEFINE
-                    elif label in self.symbol_def_to_num:
+                    elif self.__is_symbol_defined(label):
                         return ErrorCodes.DEFINE_REDEF
                     else:
                         # Add the mapping to the label -> value mapping
@@ -240,7 +540,7 @@ class Assembler(object):
             
                     if label == 'DEPTH':
                         return ErrorCodes.DEPTH_DEFINE
-                    elif label in self.symbol_def_to_num:
+                    elif label is not None and self.__is_symbol_defined(label):
                         return ErrorCodes.DEFINE_REDEF
                     elif label is not None:
                         # Label was defined, add it to the mapping
@@ -256,9 +556,87 @@ class Assembler(object):
             self.line += 1
         #ENDFOR
             
+        return self.__resolve_defines()
+        
+        
+    def __resolve_defines(self):
+        """
+        Evaluates the .define expressions into symbol_def_to_num. A define may use labels and
+        other defines declared anywhere in the file, so the defines are visited depth-first
+        along their dependencies and each value is computed exactly once, after the values it
+        depends on.
+        Returns:
+            int: ErrorCodes.NO_ERROR on success, some error code on failure.
+        """
+        # Defines on the current dependency path, used to detect cycles
+        visiting = set()
+        
+        # Defines with deferred value errors
+        failed = set()
+        
+        for symbol in self.define_to_expr:
+            if symbol in self.symbol_def_to_num or symbol in failed:
+                # Already resolved as a dependency of an earlier define
+                continue
+            
+            # Explicit stack of (define, iterator over its symbols) to avoid deep recursion
+            visiting.add(symbol)
+            stack = [(symbol, iter(self.define_to_expr[symbol][0].symbols))]
+            
+            while stack:
+                (top, deps) = stack[-1]
+                (expr, line) = self.define_to_expr[top]
+                
+                # Find the next dependency that is an unresolved define
+                dep = next((d for d in deps if d in self.define_to_expr and 
+                    d not in self.symbol_def_to_num and d not in failed), None)
+                
+                if dep is None:
+                    # All dependencies are resolved, evaluate this define
+                    self.line = line
+                    try:
+                        num = expr.evaluate(self.symbol_def_to_num)
+                        error = ErrorCodes.NO_ERROR
+                        if self.__is_number_too_large(num):
+                            error = ErrorCodes.BIG_DEFINE
+                    except ExpressionError as e:
+                        error = e.error_code
+                    
+                    if error is ErrorCodes.NO_ERROR:
+                        self.symbol_def_to_num[top] = num
+                    elif self.defer_value_errors and error in self.VALUE_ERRORS:
+                        # Leave the define unresolved, the defines that use it fail too
+                        failed.add(top)
+                    else:
+                        return error
+                    visiting.remove(top)
+                    stack.pop()
+                elif dep in visiting:
+                    self.line = line
+                    return ErrorCodes.DEFINE_CYCLE
+                else:
+                    visiting.add(dep)
+                    stack.append((dep, iter(self.define_to_expr[dep][0].symbols)))
+            #ENDWHILE
+        #ENDFOR
+        
+        if self.defer_value_errors:
+            self.bad_defines = failed
+        
         return ErrorCodes.NO_ERROR
         
         
+    def __is_symbol_defined(self, symbol):
+        """
+        Determines if a symbol is already used by a label or a define.
+        Args:
+            symbol: The symbol name.
+        Returns:
+            Boolean: True if the symbol is defined.
+        """
+        return symbol in self.symbol_def_to_num or symbol in self.define_to_expr
+        
+        
     def __parse_lines(self):
         """
         Processing. Parses the lines of the input file.
@@ -285,6 +663,7 @@ class Assembler(object):
                         # Add assembled machine code to the machine instructions
                         self.machine_instructions.extend(sub_mif)
                         self.is_inst.extend([True])
+                        self.instr_num_to_line.extend([self.line])
                     else:
                         return error
                 elif self.INSTR_TYPE2_REGEX.match(line):
@@ -296,6 +675,7 @@ class Assembler(object):
                         # Add assembled machine code to the machine instructions
                         self.machine_instructions.extend(sub_mif)
                         self.is_inst.extend([True])
+                        self.instr_num_to_line.extend([self.line])
                     else:
                         return error
                 elif self.INSTR_TYPE3_REGEX.match(line):
@@ -307,6 +687,7 @@ class Assembler(object):
                         # Add assembled machine code to the machine instructions
                         self.machine_instructions.extend(sub_mif)
                         self.is_inst.extend([True])
+                        self.instr_num_to_line.extend([self.line])
                     else:
                         return error
                 elif self.WORD_DIR_REGEX.match(line):
@@ -320,6 +701,7 @@ class Assembler(object):
                         self.machine_instructions.extend(sub_mif)
                         # put False into is_inst array to indicate data item
                         self.is_inst.extend([False])
+                        self.instr_num_to_line.extend([self.line])
                     else:
                         return error
             
@@ -330,20 +712,39 @@ class Assembler(object):
         return ErrorCodes.NO_ERROR
         
         
-    def __output_file(self):
+    def __output_file(self, out_filename):
         """
-        Outputs the machine instructions to the output mif file.
+        Outputs the machine instructions to a mif file.
+        Args:
+            out_filename: The name of the mif file.
         """
-        # Open file for writing, should already be verified.
-        out_file = open(self.out_filename, 'w')
+        self.__write_output(out_filename, self.__format_mif())
+        self.out_filenames.append(out_filename)
+
+
+    def __output_depfile(self):
+        """
+        Outputs the dependency file, if one was requested.
+        """
+        if self.dep_filename is not None and self.out_filenames:
+            self.__write_output(self.dep_filename, self.__format_depfile())
+
+
+    def __format_mif(self):
+        """
+        Formats the machine instructions as the contents of a MIF file.
+        Returns:
+            str: The complete MIF file text.
+        """
+        mif_lines = []
         
         ####################################################
         ## MIF Data.
-        out_file.write('WIDTH = ' + str(self.width_bits) + ';\n')
-        out_file.write('DEPTH = ' + str(self.depth_words) + ';\n')
-        out_file.write('ADDRESS_RADIX = HEX;\n')
-        out_file.write('DATA_RADIX = HEX;\n\n')
-        out_file.write('CONTENT\nBEGIN\n')
+        mif_lines.append('WIDTH = ' + str(self.width_bits) + ';\n')
+        mif_lines.append('DEPTH = ' + str(self.depth_words) + ';\n')
+        mif_lines.append('ADDRESS_RADIX = HEX;\n')
+        mif_lines.append('DATA_RADIX = HEX;\n\n')
+        mif_lines.append('CONTENT\nBEGIN\n')
         
         ########################
         ## Instructions.
@@ -367,17 +768,121 @@ class Assembler(object):
             if write_comment:
                 # Convert the current instruction into a comment.
                 comment_str = self.__instruction_to_comment(instruction)
-                out_file.write(instruction_num_str + '\t\t: ' + instruction_str + ';\t\t% ' + 
+                mif_lines.append(instruction_num_str + '\t\t: ' + instruction_str + ';\t\t% ' + 
                     comment_str + '\n')
             else:
-                out_file.write(instruction_num_str + '\t\t: ' + instruction_str + ';\t\t% ' + 
+                mif_lines.append(instruction_num_str + '\t\t: ' + instruction_str + ';\t\t% ' + 
                 'data %\n')
             
         #ENDWHILE
         ########################
         
-        out_file.write('END;\n')
+        mif_lines.append('END;\n')
         ####################################################
+        
+        return ''.join(mif_lines)
+
+
+    def __format_depfile(self):
+        """
+        Formats a make-style dependency file listing every input of the output files. Each
+        input also gets an empty rule so that deleting it does not break the build.
+        Returns:
+            str: The complete dependency file text.
+        """
+        inputs = [self.__escape_dep_path(name) for name in self.input_filenames]
+        
+        targets = [self.__escape_dep_path(name) for name in self.out_filenames]
+        
+        dep_lines = [' '.join(targets) + ': ' + ' '.join(inputs) + '\n']
+        for name in inputs:
+            dep_lines.append('\n' + name + ':\n')
+        
+        return ''.join(dep_lines)
+
+
+    def __escape_dep_path(self, path):
+        """
+        Escapes a path for use in a make rule.
+        Args:
+            path: The path to escape.
+        Returns:
+            str: The path with spaces and $ escaped.
+        """
+        return path.replace('$', '$$').replace(' ', '\\ ')
+
+
+    def __write_output(self, filename, text):
+        """
+        Writes text to a file through a temporary file and an atomic rename, so that an
+        interrupted run never leaves a partially written file. If update_only is set and the
+        file already holds the same content it is not touched, which keeps its modification
+        time and avoids needless rebuilds downstream.
+        Args:
+            filename: The name of the file to write.
+            text: The complete contents of the file.
+        Returns:
+            Boolean: True if the file was written, False if it was left unchanged.
+        """
+        # Write through symbolic links to the file they point to, as a plain open() would,
+        # instead of replacing the link itself
+        filename = os.path.realpath(filename)
+        
+        if self.update_only and self.__file_digest(filename) == self.__text_digest(text):
+            return False
+        
+        # The temporary file must be in the same folder for the rename to be atomic
+        out_dir = os.path.dirname(filename)
+        (fd, temp_filename) = tempfile.mkstemp(dir=out_dir, 
+            prefix='.' + os.path.basename(filename) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as out_file:
+                out_file.write(text)
+            # mkstemp creates a private file. Keep the permissions of the file being replaced,
+            # or give a new file the permissions a plain open() would.
+            if os.path.exists(filename):
+                mode = stat.S_IMODE(os.stat(filename).st_mode)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(temp_filename, mode)
+            os.replace(temp_filename, filename)
+        except:
+            os.remove(temp_filename)
+            raise
+        
+        return True
+
+
+    def __file_digest(self, filename):
+        """
+        Hashes the contents of an existing file.
+        Args:
+            filename: The name of the file to hash.
+        Returns:
+            str: The hex digest of the file contents, None if the file cannot be read.
+        """
+        digest = hashlib.sha256()
+        try:
+            with open(filename, 'r') as in_file:
+                for chunk in iter(lambda: in_file.read(65536), ''):
+                    digest.update(chunk.encode())
+        except (OSError, UnicodeDecodeError):
+            return None
+        
+        return digest.hexdigest()
+
+
+    def __text_digest(self, text):
+        """
+        Hashes a string the same way __file_digest hashes a file.
+        Args:
+            text: The string to hash.
+        Returns:
+            str: The hex digest of the string.
+        """
+        return hashlib.sha256(text.encode()).hexdigest()
 
     
     def __validate_out_filename(self):
@@ -441,22 +946,39 @@ class Assembler(object):
         # Grab the instruction, register and immediate value from the REGEX.
         instr = self.INSTR_STR_TO_VAL.get(match.group(3))
         ra = self.REG_STR_TO_VAL.get(match.group(4))
-        imm_str = match.group(5)
-        imm = None
         try:
-            imm = int(imm_str, 0)
-        except ValueError:
-            # see if the immediate is a valid symbolic name
-            imm = self.symbol_def_to_num.get(imm_str)
-            if imm is None:
-                return ErrorCodes.IMMED_LABEL_NF, []
+            expr = Expression(match.group(5))
+        except ExpressionError as e:
+            return e.error_code, []
+        
+        self.immediate_operands.append((self.curr_instr_num + 1, self.line, 
+            self.__encode_type2_instruction, instr, ra, expr))
+        return self.__defer_value_error(self.__encode_type2_instruction(instr, ra, expr))
+    
+    
+    def __encode_type2_instruction(self, instr, ra, expr):
+        """
+        Evaluates the immediate of a type 2 instruction and converts it to machine code.
+        Args:
+            instr: the instruction int.
+            ra: The first regsiter int.
+            expr: The Expression of the immediate operand.
+        Returns:
+            int: ErrorCodes.NO_ERROR on success, some error code on failure.
+            [int]: An array of MIF instructions which is the assembled machine code.
+        """
+        (error, imm) = self.__evaluate_immediate(expr)
+        if error != ErrorCodes.NO_ERROR:
+            return error, []
         
         # error check the value of the immediate constant
         if self.INSTR_VAL_TO_STR[instr] != 'mvt ':
             if self.__is_number_too_large_imm(imm):
                 return ErrorCodes.BIG_IMMED, []
         else:
-            if self.__is_number_bad_imm(imm):
+            if self.__is_number_too_large(imm):
+                return ErrorCodes.BIG_IMMED, []
+            elif self.__is_number_bad_imm(imm):
                 return ErrorCodes.BAD_IMMED, []
 
         if instr is None:
@@ -485,18 +1007,34 @@ class Assembler(object):
             cond = self.COND_STR_TO_VAL.get(match.group(4))
         else:
             cond = self.COND_STR_TO_VAL.get('')
-        address = match.group(5)
-        imm = None
         try:
-            imm = int(address, 0)
-        except ValueError:
-            # see if the immediate is a valid symbolic name
-            imm = self.symbol_def_to_num.get(address)
-            if imm is None:
-                return ErrorCodes.IMMED_LABEL_NF, []
+            expr = Expression(match.group(5))
+        except ExpressionError as e:
+            return e.error_code, []
+        
+        self.immediate_operands.append((self.curr_instr_num + 1, self.line, 
+            self.__encode_type3_instruction, instr, cond, expr))
+        return self.__defer_value_error(self.__encode_type3_instruction(instr, cond, expr))
+    
+    
+    def __encode_type3_instruction(self, instr, cond, expr):
+        """
+        Evaluates the address of a type 3 instruction (branch) and converts it to machine
+        code.
+        Args:
+            instr: the instruction int. for branch
+            cond: The branch condition int.
+            expr: The Expression of the branch address.
+        Returns:
+            int: ErrorCodes.NO_ERROR on success, some error code on failure.
+            [int]: An array of MIF instructions which is the assembled machine code.
+        """
+        (error, imm) = self.__evaluate_immediate(expr)
+        if error != ErrorCodes.NO_ERROR:
+            return error, []
         
         # error check the value of the immediate constant (#Label)
-        if imm >= self.depth_words:
+        if imm < 0 or imm >= self.depth_words:
             return ErrorCodes.BIG_BRANCH, []
 
         if instr is None:
@@ -506,6 +1044,40 @@ class Assembler(object):
         return ErrorCodes.NO_ERROR, [mif_instr]
     
     
+    def __defer_value_error(self, result):
+        """
+        Records an instruction with a value error instead of failing, if value errors are
+        deferred. The instruction is assembled as 0 until a variant encodes it again.
+        Args:
+            result: The (error, machine code) result of encoding the current instruction.
+        Returns:
+            int: ErrorCodes.NO_ERROR if the error was deferred, otherwise the given error.
+            [int]: An array of MIF instructions which is the assembled machine code.
+        """
+        (error, sub_mif) = result
+        
+        if self.defer_value_errors and error in self.VALUE_ERRORS:
+            self.bad_operands.add(self.curr_instr_num + 1)
+            return ErrorCodes.NO_ERROR, [0]
+        
+        return result
+    
+    
+    def __evaluate_immediate(self, expr):
+        """
+        Evaluates the expression of an immediate operand.
+        Args:
+            expr: The Expression of the immediate operand.
+        Returns:
+            int: ErrorCodes.NO_ERROR on success, some error code on failure.
+            int: The value of the immediate, None on failure.
+        """
+        try:
+            return ErrorCodes.NO_ERROR, expr.evaluate(self.symbol_def_to_num)
+        except ExpressionError as e:
+            return e.error_code, None
+    
+    
     def __make_type1_instruction(self, instr, ra, rb):
         """
         Converts an instruction to machine code.
@@ -574,7 +1146,7 @@ class Assembler(object):
         Returns:
             Boolean: True if the number is too large.
         """
-        return num > self.MAX_INT_16U
+        return num < 0 or num > self.MAX_INT_16U
 
     def __is_number_too_large_imm(self, num):
         """
@@ -584,7 +1156,7 @@ class Assembler(object):
         Returns:
             Boolean: True if the number is too large.
         """
-        return num > self.MAX_INT_IMM
+        return num < 0 or num > self.MAX_INT_IMM
 
 
     def __is_number_bad_imm(self, num):
@@ -606,6 +1178,18 @@ class Assembler(object):
         Returns:
             str: The string form of the instruction.
         """
+        return self.decode_instruction(instr) + ' %'
+
+
+    @classmethod
+    def decode_instruction(cls, instr):
+        """
+        Converts a word of machine code back to assembly language.
+        Args:
+            instr: The machine code word.
+        Returns:
+            str: The string form of the instruction.
+        """
         # Parse out the instruction and first and second registers.
         rb = instr & 0x0007
         ra = (instr >> 9) & 0x0007
@@ -615,24 +1199,23 @@ class Assembler(object):
         cond = (instr >> 9) & 0x0007
         
         # Create the comment for branch instructions
-        if i == self.INSTR_STR_TO_VAL['b']:
-            comment = self.INSTR_VAL_TO_STR[i] + self.COND_VAL_TO_STR[cond] + '  '
+        if i == cls.INSTR_STR_TO_VAL['b']:
+            comment = cls.INSTR_VAL_TO_STR[i] + cls.COND_VAL_TO_STR[cond] + '  '
         else:
-            comment = self.INSTR_VAL_TO_STR[i] + ' ' + self.REG_VAL_TO_STR[ra] + ', '
+            comment = cls.INSTR_VAL_TO_STR[i] + ' ' + cls.REG_VAL_TO_STR[ra] + ', '
         
         # Append the immediate value if used
         if imm == 1:
-            if self.INSTR_VAL_TO_STR[i] != 'mvt ':
+            if cls.INSTR_VAL_TO_STR[i] != 'mvt ':
                 comment += '#0x%04x' % (instr & 0x1FF)
             else:
                 comment += '#0x%04x' % ((instr & 0x1FF) << 8)
         else:
-            if self.INSTR_VAL_TO_STR[i] == 'ld  ' or self.INSTR_VAL_TO_STR[i] == 'st  ':
-                comment += '[' + self.REG_VAL_TO_STR[rb] + ']'
+            if cls.INSTR_VAL_TO_STR[i] == 'ld  ' or cls.INSTR_VAL_TO_STR[i] == 'st  ':
+                comment += '[' + cls.REG_VAL_TO_STR[rb] + ']'
             else:
-                comment += self.REG_VAL_TO_STR[rb]
+                comment += cls.REG_VAL_TO_STR[rb]
             
-        comment += ' %'
         return comment
         
         
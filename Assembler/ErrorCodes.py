@@ -17,7 +17,10 @@ class ErrorCodes(object):
     BAD_DATA           = 9
     DEPTH_DEFINE       = 10
     BIG_BRANCH         = 11
-    UNKNOWN            = 12        # Always the last error
+    BAD_EXPR           = 12
+    DEFINE_CYCLE       = 13
+    OVERRIDE_NF        = 14
+    UNKNOWN            = 15        # Always the last error
     
     
     @staticmethod
@@ -53,5 +56,10 @@ class ErrorCodes(object):
                 ': symbol DEPTH is reserved, it cannot be redefined',
             ErrorCodes.BIG_BRANCH     : 'ERROR: line ' + line_str + 
                 ': the branch target is too large',
+            ErrorCodes.BAD_EXPR       : 'ERROR: line ' + line_str + 
+                ': syntax error in expression',
+            ErrorCodes.DEFINE_CYCLE   : 'ERROR: line ' + line_str + 
+                ': define depends on itself',
+            ErrorCodes.OVERRIDE_NF    : 'ERROR: only .define symbols and DEPTH can be overridden',
             ErrorCodes.UNKNOWN        : 'ERROR: UNKNOWN'
         }[error_code]
@@ -0,0 +1,224 @@
+import re
+
+from ErrorCodes import *
+
+
+class ExpressionError(Exception):
+    """
+    Raised when an expression cannot be parsed or evaluated.
+    """
+
+    def __init__(self, error_code):
+        """
+        Initializes the exception.
+        Args:
+            error_code: The ErrorCodes value describing the problem.
+        """
+        Exception.__init__(self, error_code)
+        self.error_code = error_code
+
+
+class Expression(object):
+    """
+    A constant expression used as the operand of a .define or an immediate.
+
+    Supports integer literals, symbols (defines and labels), parentheses, the binary
+    operators + - * << >> & | with C precedence, and the HI() and LO() operators. HI(x) is
+    x with its eight least-significant bits cleared, as needed by mvt, and LO(x) is the
+    eight least-significant bits of x.
+    """
+
+    # REGEX to match one token. Group 1 is a number, group 2 a symbol, group 3 an operator
+    TOKEN_REGEX = re.compile('\s*(?:(\d\w*)|([a-zA-Z_$][a-zA-Z_$0-9]*)|(<<|>>|[-+*&|()]))')
+
+    # Binary operators, grouped from lowest to highest precedence
+    BINARY_OPS = [['|'], ['&'], ['<<', '>>'], ['+', '-'], ['*']]
+
+    # Maps operator strings to the functions that apply them
+    OP_STR_TO_FUNC = {
+        '|'  : lambda a, b: a | b,
+        '&'  : lambda a, b: a & b,
+        '<<' : lambda a, b: a << b,
+        '>>' : lambda a, b: a >> b,
+        '+'  : lambda a, b: a + b,
+        '-'  : lambda a, b: a - b,
+        '*'  : lambda a, b: a * b,
+        'HI' : lambda a: a & ~0xFF,
+        'LO' : lambda a: a & 0xFF
+    }
+
+    # Largest shift count allowed, so that a shift cannot build a huge number
+    MAX_SHIFT = 64
+
+    def __init__(self, text):
+        """
+        Parses an expression.
+        Args:
+            text: The expression string.
+        Raises:
+            ExpressionError: If the expression is malformed.
+        """
+        self.text = text
+
+        # The names of all symbols used by the expression
+        self.symbols = set()
+
+        self.tokens = self.__tokenize(text)
+        self.pos = 0
+        try:
+            self.tree = self.__parse_binary(0)
+        except RecursionError:
+            # Parentheses nested too deeply
+            raise ExpressionError(ErrorCodes.BAD_EXPR)
+        if self.pos != len(self.tokens):
+            raise ExpressionError(ErrorCodes.BAD_EXPR)
+
+        # The tokens are only needed while parsing
+        self.tokens = None
+
+
+    def evaluate(self, symbol_to_num):
+        """
+        Evaluates the expression.
+        Args:
+            symbol_to_num: Maps symbol names to their integer values.
+        Returns:
+            int: The value of the expression.
+        Raises:
+            ExpressionError: If a symbol is not defined, or a shift count is out of range.
+        """
+        try:
+            return self.__evaluate_node(self.tree, symbol_to_num)
+        except RecursionError:
+            # Too many operators for the parse tree to be walked
+            raise ExpressionError(ErrorCodes.BAD_EXPR)
+
+
+    def __tokenize(self, text):
+        """
+        Splits an expression string into tokens.
+        Args:
+            text: The expression string.
+        Returns:
+            [(str, object)]: A list of (kind, value) tokens, where kind is 'num', 'sym' or 'op'.
+        """
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+
+        while pos < len(text):
+            match = self.TOKEN_REGEX.match(text, pos)
+            if match is None:
+                raise ExpressionError(ErrorCodes.BAD_EXPR)
+
+            if match.group(1) is not None:
+                try:
+                    tokens.append(('num', int(match.group(1), 0)))
+                except ValueError:
+                    # Same error as a bad literal immediate
+                    raise ExpressionError(ErrorCodes.IMMED_LABEL_NF)
+            elif match.group(2) is not None:
+                tokens.append(('sym', match.group(2)))
+            else:
+                tokens.append(('op', match.group(3)))
+            pos = match.end()
+        #ENDWHILE
+
+        return tokens
+
+
+    def __peek(self):
+        """
+        Returns:
+            (str, object): The current token, or (None, None) at the end of the expression.
+        """
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+
+    def __expect(self, op):
+        """
+        Consumes the given operator token.
+        Args:
+            op: The operator string that must come next.
+        """
+        if self.__peek() != ('op', op):
+            raise ExpressionError(ErrorCodes.BAD_EXPR)
+        self.pos += 1
+
+
+    def __parse_binary(self, level):
+        """
+        Parses binary operators of the given precedence level and above.
+        Args:
+            level: An index into BINARY_OPS.
+        Returns:
+            tuple: The parse tree node.
+        """
+        if level == len(self.BINARY_OPS):
+            return self.__parse_operand()
+
+        node = self.__parse_binary(level + 1)
+        (kind, value) = self.__peek()
+        while kind == 'op' and value in self.BINARY_OPS[level]:
+            self.pos += 1
+            node = ('op', value, node, self.__parse_binary(level + 1))
+            (kind, value) = self.__peek()
+
+        return node
+
+
+    def __parse_operand(self):
+        """
+        Parses a number, a symbol, HI() or LO(), or a parenthesized expression.
+        Returns:
+            tuple: The parse tree node.
+        """
+        (kind, value) = self.__peek()
+        self.pos += 1
+
+        if kind == 'num':
+            return ('num', value)
+        elif kind == 'sym' and value in ('HI', 'LO') and self.__peek() == ('op', '('):
+            self.pos += 1
+            node = ('fn', value, self.__parse_binary(0))
+            self.__expect(')')
+            return node
+        elif kind == 'sym':
+            self.symbols.add(value)
+            return ('sym', value)
+        elif (kind, value) == ('op', '('):
+            node = self.__parse_binary(0)
+            self.__expect(')')
+            return node
+        else:
+            raise ExpressionError(ErrorCodes.BAD_EXPR)
+
+
+    def __evaluate_node(self, node, symbol_to_num):
+        """
+        Evaluates one node of the parse tree.
+        Args:
+            node: The parse tree node.
+            symbol_to_num: Maps symbol names to their integer values.
+        Returns:
+            int: The value of the node.
+        """
+        if node[0] == 'num':
+            return node[1]
+        elif node[0] == 'sym':
+            num = symbol_to_num.get(node[1])
+            if num is None:
+                raise ExpressionError(ErrorCodes.IMMED_LABEL_NF)
+            return num
+        elif node[0] == 'fn':
+            return self.OP_STR_TO_FUNC[node[1]](self.__evaluate_node(node[2], symbol_to_num))
+        else:
+            left = self.__evaluate_node(node[2], symbol_to_num)
+            right = self.__evaluate_node(node[3], symbol_to_num)
+            
+            if node[1] in ('<<', '>>') and not 0 <= right <= self.MAX_SHIFT:
+                # Same error as a bad literal immediate
+                raise ExpressionError(ErrorCodes.IMMED_LABEL_NF)
+            return self.OP_STR_TO_FUNC[node[1]](left, right)
@@ -0,0 +1,239 @@
+import re
+import sys
+from array import array
+
+
+class ImageError(Exception):
+    """
+    Raised when a memory image cannot be read.
+    """
+    pass
+
+
+class Image(object):
+    """
+    A memory image loaded from a MIF file or a raw binary dump, held as a compact array of
+    16-bit words.
+    """
+
+    # REGEX to match the comments of a MIF file, % ... % and -- to the end of the line
+    MIF_COMMENT_REGEX = re.compile('%[^%]*%|--[^\n]*')
+
+    # REGEX to match a NAME = VALUE; header line of a MIF file
+    MIF_HEADER_REGEX = re.compile('^\s*(WIDTH|DEPTH|ADDRESS_RADIX|DATA_RADIX)\s*=\s*(\w+)\s*;',
+        re.MULTILINE | re.IGNORECASE)
+
+    # REGEX to match the CONTENT section of a MIF file
+    MIF_CONTENT_REGEX = re.compile('CONTENT\s+BEGIN(.*?)END\s*;', re.DOTALL | re.IGNORECASE)
+
+    # REGEX to match an address, or an address range [a..b], and its data words
+    MIF_ENTRY_REGEX = re.compile('^\s*(?:\[(\w+)\.\.(\w+)\]|(\w+))\s*:\s*(\w+(?:\s+\w+)*)\s*$')
+
+    # Maps MIF radix names to number bases
+    MIF_RADIX_TO_BASE = {'HEX': 16, 'DEC': 10, 'UNS': 10, 'OCT': 8, 'BIN': 2}
+
+    # Number of words compared at once when looking for changes
+    BLOCK_WORDS = 1024
+
+    def __init__(self, filename):
+        """
+        Loads an image. Files ending in .mif are read as MIF files, anything else as raw
+        binary with little-endian 16-bit words.
+        Args:
+            filename: The image filename.
+        Raises:
+            ImageError: If the file cannot be read or is malformed.
+        """
+        self.filename = filename
+
+        try:
+            if filename.lower().endswith('.mif'):
+                with open(filename, 'r') as in_file:
+                    self.words = self.__parse_mif(in_file.read())
+            else:
+                with open(filename, 'rb') as in_file:
+                    self.words = self.__parse_binary(in_file.read())
+        except (OSError, UnicodeDecodeError):
+            raise ImageError('Image file: ' + filename + ' is invalid')
+
+
+    def diff(self, other):
+        """
+        Finds the words that differ between this image and another one. The shorter image is
+        treated as if it were padded with zeros.
+        Args:
+            other: The Image to compare with.
+        Returns:
+            [(int, int)]: The changed address ranges as (first, last + 1) pairs.
+        """
+        (old_words, new_words) = self.__padded_words(other)
+
+        # Compare whole blocks as bytes, and only look at the words of blocks that differ
+        old_bytes = memoryview(old_words).cast('B')
+        new_bytes = memoryview(new_words).cast('B')
+        if old_bytes == new_bytes:
+            return []
+
+        ranges = []
+        block_bytes = self.BLOCK_WORDS * old_words.itemsize
+
+        for block_start in range(0, len(old_bytes), block_bytes):
+            block_end = block_start + block_bytes
+            if old_bytes[block_start:block_end] == new_bytes[block_start:block_end]:
+                continue
+
+            first = block_start // old_words.itemsize
+            last = min(first + self.BLOCK_WORDS, len(old_words))
+            for address in range(first, last):
+                if old_words[address] == new_words[address]:
+                    continue
+                if ranges and ranges[-1][1] == address:
+                    # Extend the range that ends at the previous word
+                    ranges[-1] = (ranges[-1][0], address + 1)
+                else:
+                    ranges.append((address, address + 1))
+        #ENDFOR
+
+        return ranges
+
+
+    def diff_report(self, other, ranges, decode_instruction, instr_num_to_line=None, 
+            source_lines=None):
+        """
+        Describes the differences between this image and another one. A difference in depth
+        is mentioned, but only the words that differ count as changes.
+        Args:
+            other: The Image to compare with.
+            ranges: The changed address ranges, as returned by diff.
+            decode_instruction: Converts a word of machine code to a string.
+            instr_num_to_line: The source line of each address of the other image, if known.
+            source_lines: The lines of the source file of the other image, if known.
+        Returns:
+            [str]: The lines of the report.
+        """
+        (old_words, new_words) = self.__padded_words(other)
+        report = []
+
+        if len(self.words) != len(other.words):
+            report.append('Depth differs: ' + str(len(self.words)) + ' words in ' +
+                self.filename + ', ' + str(len(other.words)) + ' words in ' + other.filename)
+
+        for (first, last) in ranges:
+            report.append('Changed 0x%04x-0x%04x (%d words)' % (first, last - 1, last - first))
+
+            for address in range(first, last):
+                entry = '  %04x: %04x %-18s -> %04x %-18s' % (address, old_words[address],
+                    decode_instruction(old_words[address]), new_words[address],
+                    decode_instruction(new_words[address]))
+
+                if instr_num_to_line is not None and address < len(instr_num_to_line):
+                    line = instr_num_to_line[address]
+                    entry += '  line ' + str(line)
+                    if source_lines is not None:
+                        entry += ': ' + source_lines[line - 1].strip()
+                report.append(entry.rstrip())
+        #ENDFOR
+
+        if ranges:
+            report.append(str(sum(last - first for (first, last) in ranges)) +
+                ' words differ in ' + str(len(ranges)) + ' ranges')
+
+        return report
+
+
+    def __padded_words(self, other):
+        """
+        Pads the words of this image and another one with zeros to the same length.
+        Args:
+            other: The other Image.
+        Returns:
+            array: The words of this image.
+            array: The words of the other image.
+        """
+        length = max(len(self.words), len(other.words))
+        old_words = self.words
+        new_words = other.words
+
+        if len(old_words) < length:
+            old_words = old_words + array('H', bytes(2 * (length - len(old_words))))
+        if len(new_words) < length:
+            new_words = new_words + array('H', bytes(2 * (length - len(new_words))))
+
+        return old_words, new_words
+
+
+    def __parse_mif(self, text):
+        """
+        Parses the text of a MIF file. Addresses that are not listed are zero.
+        Args:
+            text: The MIF file text.
+        Returns:
+            array: The words of the image.
+        """
+        text = self.MIF_COMMENT_REGEX.sub('', text)
+        headers = dict((name.upper(), value.upper()) for (name, value) in
+            self.MIF_HEADER_REGEX.findall(text))
+
+        try:
+            width = int(headers.get('WIDTH', '16'))
+            depth = int(headers['DEPTH'])
+            address_base = self.MIF_RADIX_TO_BASE[headers.get('ADDRESS_RADIX', 'HEX')]
+            data_base = self.MIF_RADIX_TO_BASE[headers.get('DATA_RADIX', 'HEX')]
+        except (KeyError, ValueError):
+            raise ImageError('Image file: ' + self.filename + ' has a bad or missing header')
+
+        content = self.MIF_CONTENT_REGEX.search(text)
+        if width > 16 or content is None:
+            raise ImageError('Image file: ' + self.filename + ' is not a 16-bit MIF file')
+
+        words = array('H', bytes(2 * depth))
+
+        for entry in content.group(1).split(';'):
+            if not entry.strip():
+                continue
+
+            match = self.MIF_ENTRY_REGEX.match(entry)
+            try:
+                if match.group(3) is not None:
+                    first = int(match.group(3), address_base)
+                    last = None
+                else:
+                    first = int(match.group(1), address_base)
+                    last = int(match.group(2), address_base)
+                data = [int(word, data_base) for word in match.group(4).split()]
+
+                if last is None:
+                    # Consecutive words starting at the address
+                    words[first:first + len(data)] = array('H', data)
+                else:
+                    # The data words repeated over the range
+                    for address in range(first, last + 1):
+                        words[address] = data[(address - first) % len(data)]
+            except (AttributeError, ValueError, IndexError, OverflowError):
+                raise ImageError('Image file: ' + self.filename + ': bad content ' +
+                    entry.strip())
+        #ENDFOR
+
+        if len(words) != depth:
+            raise ImageError('Image file: ' + self.filename + ': content is larger than DEPTH')
+
+        return words
+
+
+    def __parse_binary(self, data):
+        """
+        Parses a raw binary image of little-endian 16-bit words.
+        Args:
+            data: The file contents.
+        Returns:
+            array: The words of the image.
+        """
+        if len(data) % 2 != 0:
+            raise ImageError('Image file: ' + self.filename + ' has an odd number of bytes')
+
+        words = array('H')
+        words.frombytes(data)
+        if sys.byteorder != 'little':
+            words.byteswap()
+
+        return words
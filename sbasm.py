@@ -1,18 +1,140 @@
+import os
 import sys
 from Assembler.Assembler import Assembler
+from Assembler.Image import Image, ImageError
 
 
 def print_usage():
 	"""
 	Prints the usage for this script.
 	"""
-	print('Usage: python sbasm.py <input file name> <output file name, default a.mif>')
-	
-	
+	print('Usage: python sbasm.py [options] <input file name> <output file name, default a.mif>')
+	print('Options:')
+	print('  --update           do not rewrite output files whose content is unchanged')
+	print('  --depfile[=NAME]   write a make-style dependency file, default <output>.d')
+	print('  --variant=NAME:SYMBOL=VALUE,...')
+	print('                     assemble with these .define values into <output>_NAME.mif,')
+	print('                     instead of into <output>')
+	print('  --variants=FILE    read variants from FILE, one NAME:SYMBOL=VALUE,... per line')
+	print('')
+	print('       python sbasm.py diff [--source=FILE] <old image> <new image>')
+	print('       python sbasm.py verify <old image> <new image>')
+	print('Images are MIF files, or raw binary files of little-endian 16-bit words.')
+	print('diff lists the changed addresses, with their source lines if the source file of the')
+	print('new image is given. verify prints nothing. Both exit with 0 if the images are the')
+	print('same, 1 if they differ and 2 on error.')
+
+
+def default_dep_filename(out_filename):
+	"""
+	Derives the dependency filename from the output filename.
+	Args:
+		out_filename: The output filename.
+	Returns:
+		str: The output filename with its .mif extension replaced by .d
+	"""
+	if out_filename.endswith('.mif'):
+		out_filename = out_filename[:-len('.mif')]
+	return out_filename + '.d'
+
+
+def compare_images(command, options, args):
+	"""
+	Runs the diff and verify commands.
+	Args:
+		command: 'diff' or 'verify'.
+		options: The -- options given after the command.
+		args: The image file names.
+	Returns:
+		int: The exit code, 0 if the images are the same, 1 if they differ, 2 on error.
+	"""
+	source_filename = None
+
+	for option in options:
+		if command == 'diff' and option.startswith('--source='):
+			source_filename = option[len('--source='):]
+		else:
+			print('ERROR: Unknown option ' + option + '.')
+			print_usage()
+			return 2
+
+	if len(args) != 2:
+		print('ERROR: Expected two image file names.')
+		print_usage()
+		return 2
+
+	if source_filename is not None and not os.path.isfile(source_filename):
+		print('ERROR: Source file: ' + source_filename + ' is invalid')
+		return 2
+
+	try:
+		old_image = Image(args[0])
+		new_image = Image(args[1])
+	except ImageError as e:
+		print('ERROR: ' + str(e))
+		return 2
+
+	changed = old_image.diff(new_image)
+
+	if command == 'verify':
+		return 1 if changed else 0
+
+	# Map the addresses of the new image back to the lines of its source file
+	instr_num_to_line = None
+	source_lines = None
+	if source_filename is not None:
+		a = Assembler(source_filename, None)
+		instr_num_to_line = a.map_lines()
+		if instr_num_to_line is None:
+			return 2
+		source_lines = a.lines
+
+	report = old_image.diff_report(new_image, changed, Assembler.decode_instruction, 
+		instr_num_to_line, source_lines)
+	for line in report:
+		print(line)
+
+	return 1 if changed else 0
+
+
 if __name__ == "__main__":
-	argc = len(sys.argv)
-	
-	if argc >= 4:
+	if len(sys.argv) > 1 and sys.argv[1] in ('diff', 'verify'):
+		options = [arg for arg in sys.argv[2:] if arg.startswith('--')]
+		args = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+		sys.exit(compare_images(sys.argv[1], options, args))
+
+	# Separate the options from the file name arguments.
+	options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+	args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+	argc = len(args) + 1
+
+	update_only = False
+	want_depfile = False
+	dep_filename = None
+	bad_option = None
+
+	# Variants in command line order, as ('variant', text) or ('variants', filename)
+	variant_options = []
+
+	for option in options:
+		if option == '--update':
+			update_only = True
+		elif option == '--depfile':
+			want_depfile = True
+		elif option.startswith('--depfile='):
+			want_depfile = True
+			dep_filename = option[len('--depfile='):]
+		elif option.startswith('--variant='):
+			variant_options.append(('variant', option[len('--variant='):]))
+		elif option.startswith('--variants='):
+			variant_options.append(('variants', option[len('--variants='):]))
+		else:
+			bad_option = option
+
+	if bad_option is not None:
+		print('ERROR: Unknown option ' + bad_option + '.')
+		print_usage()
+	elif argc >= 4:
 		print('ERROR: Too many arguments.')
 		print_usage()
 	elif argc <= 1:
@@ -21,12 +143,35 @@ if __name__ == "__main__":
 	else:
 		# Parse the in and out file names from the arguments.
 		# Default the output filename to a.mif.
-		in_filename = sys.argv[1]
+		in_filename = args[0]
 		out_filename = 'a.mif'
 
 		if argc > 2:
-			out_filename = sys.argv[2]
-		
+			out_filename = args[1]
+
+		if want_depfile and not dep_filename:
+			dep_filename = default_dep_filename(out_filename)
+
 		# Create the assembler and assemble.
-		a = Assembler(in_filename, out_filename)
-		a.assemble()
+		a = Assembler(in_filename, out_filename, update_only, dep_filename)
+
+		if not variant_options:
+			a.assemble()
+		else:
+			variants = []
+			for (kind, value) in variant_options:
+				if kind == 'variants':
+					variants.extend(a.read_variant_file(value))
+				elif Assembler.parse_variant(value) is not None:
+					variants.append(Assembler.parse_variant(value))
+				else:
+					print('ERROR: Bad variant ' + value + '.')
+					print_usage()
+					sys.exit()
+
+			duplicate = Assembler.find_duplicate_variant(variants)
+			if duplicate is not None:
+				print('ERROR: Variant ' + duplicate + ' is defined more than once.')
+				sys.exit()
+
+			a.assemble_variants(variants)
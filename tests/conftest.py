@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# The modules in the Assembler folder import each other by their plain names, as they do
+# when the folder is on PYTHONPATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'Assembler'))
+
+from Assembler import Assembler
+
+
+# A small program used by most tests
+SOURCE = """.define LED_ADDRESS 0x1000
+		mvt   r3, #LED_ADDRESS
+MAIN:	ld    r0, [r3]
+		mv    pc, #MAIN
+"""
+
+
+@pytest.fixture
+def write_source(tmp_path):
+    """
+    Returns a function that writes an assembly-language file into tmp_path.
+    """
+    def write_source(source=SOURCE, name='prog'):
+        source_path = tmp_path / (name + '.s')
+        source_path.write_text(source)
+        return source_path
+
+    return write_source
+
+
+@pytest.fixture
+def assemble(tmp_path, write_source):
+    """
+    Returns a function that writes an assembly-language file into tmp_path, assembles it
+    into <name>.mif and returns the path of the mif file.
+    """
+    def assemble(source=SOURCE, name='prog', **kwargs):
+        source_path = write_source(source, name)
+        out = tmp_path / (name + '.mif')
+        Assembler(str(source_path), str(out), **kwargs).assemble()
+        return out
+
+    return assemble
@@ -0,0 +1,67 @@
+import pytest
+
+from Image import Image
+
+
+def words(out):
+    """
+    Returns the words of a mif file.
+    """
+    return list(Image(str(out)).words)
+
+
+@pytest.mark.parametrize('expr, value', [
+    ('2 + 3 * 4', 14),
+    ('6 - 2 - 1', 3),
+    ('16 >> 2 - 1', 8),
+    ('1 << 2 + 1', 8),
+    ('1 | 2 & 3 << 1 + 1 * 2', 1),
+    ('0x30 & 0x1F | 3', 0x13),
+    ('(1 | 2) & (3 << 1)', 2),
+    ('(1 << 40) >> 32', 0x100),
+])
+def test_operators_follow_c_precedence(assemble, expr, value):
+    out = assemble('.define X ' + expr + '\n\t\tmv    r0, #X\n\t\tmv    r1, #' + expr + '\n')
+
+    assert words(out)[:2] == [0x1000 | value, 0x1200 | value]
+
+
+def test_hi_and_lo_split_an_address(assemble):
+    out = assemble('.define ADDR 0x1234\n'
+        '\t\tmvt   r3, #HI(ADDR)\n'
+        '\t\tadd   r3, #LO(ADDR)\n')
+
+    assert words(out)[:2] == [0x3612, 0x5634]
+
+
+def test_defines_and_immediates_use_labels_declared_later(assemble):
+    out = assemble('.define SIZE TABLE_END - TABLE\n'
+        '\t\tmv    r0, #SIZE\n'
+        '\t\tmv    r1, #TABLE_END + 1\n'
+        'TABLE:\t.word 7\n'
+        '\t\t.word 8\n'
+        'TABLE_END: .word 9\n')
+
+    assert words(out)[:5] == [0x1002, 0x1205, 7, 8, 9]
+
+
+@pytest.mark.parametrize('source, message', [
+    ('.define A B\n.define B A\n', 'ERROR: line 2: define depends on itself'),
+    ('.define A 0xFFFF + 1\n', 'ERROR: line 1: define value too large'),
+    ('.define A 1 - 2\n', 'ERROR: line 1: define value too large'),
+    ('\t\tmv    r0, #0x100 + 0x100\n', 'ERROR: line 1: the immediate value is too large'),
+    ('\t\tmv    r0, #1 - 2\n', 'ERROR: line 1: the immediate value is too large'),
+    ('\t\tmvt   r0, #0x100 - 1\n', 'ERROR: line 1: the immediate value for mvt should be 0 '
+        'in the eight least-significant bits'),
+    ('.define A 1 +\n', 'ERROR: line 1: syntax error in expression'),
+    ('\t\tmv    r0, #(((1)\n', 'ERROR: line 1: syntax error in expression'),
+    ('\t\tmv    r0, #' + '(' * 2000 + '1' + ')' * 2000 + '\n',
+        'ERROR: line 1: syntax error in expression'),
+    ('\t\tmv    r0, #1 << 65\n',
+        'ERROR: line 1: undeclared identifier (label or define), or value error'),
+])
+def test_errors_are_reported_on_folded_values(tmp_path, capsys, assemble, source, message):
+    out = assemble(source)
+
+    assert capsys.readouterr().out == message + '\n'
+    assert not out.exists()
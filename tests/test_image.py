@@ -0,0 +1,31 @@
+import struct
+
+from Assembler import Assembler
+from Image import Image
+
+from conftest import SOURCE
+
+
+def test_diff_reports_changed_words_with_source_lines(tmp_path, assemble):
+    old_image = Image(str(assemble(name='old')))
+    new_image = Image(str(assemble(SOURCE.replace('0x1000', '0x2000'), name='new')))
+    a = Assembler(str(tmp_path / 'new.s'), None)
+
+    assert old_image.diff(new_image) == [(0, 1)]
+    assert old_image.diff_report(new_image, [(0, 1)], Assembler.decode_instruction, 
+        a.map_lines(), a.lines) == [
+        'Changed 0x0000-0x0000 (1 words)',
+        '  0000: 3610 mvt  r3, #0x1000   -> 3620 mvt  r3, #0x2000    line 2: '
+            'mvt   r3, #LED_ADDRESS',
+        '1 words differ in 1 ranges']
+
+
+def test_binary_image_padded_with_zeros_is_the_same(tmp_path, assemble):
+    mif_image = Image(str(assemble()))
+    (tmp_path / 'dump.bin').write_bytes(struct.pack('<3H', 0x3610, 0x8003, 0x1e01))
+    bin_image = Image(str(tmp_path / 'dump.bin'))
+
+    assert mif_image.diff(bin_image) == []
+    assert mif_image.diff_report(bin_image, [], Assembler.decode_instruction) == [
+        'Depth differs: 256 words in ' + mif_image.filename + ', 3 words in ' + 
+            bin_image.filename]
@@ -0,0 +1,41 @@
+import os
+import stat
+
+
+def test_update_leaves_unchanged_output_alone(assemble):
+    out = assemble()
+    os.utime(str(out), (0, 0))
+
+    assemble(update_only=True)
+
+    assert os.stat(str(out)).st_mtime == 0
+
+
+def test_rewrite_keeps_mode_of_existing_output(assemble):
+    out = assemble()
+    os.chmod(str(out), 0o600)
+    out.write_text('stale')
+
+    assemble()
+
+    assert stat.S_IMODE(os.stat(str(out)).st_mode) == 0o600
+    assert 'mvt  r3, #0x1000' in out.read_text()
+
+
+def test_depfile_lists_inputs(tmp_path, assemble):
+    dep = tmp_path / 'prog.d'
+    assemble(dep_filename=str(dep))
+
+    first_line = dep.read_text().splitlines()[0]
+    assert first_line == str(tmp_path / 'prog.mif') + ': ' + str(tmp_path / 'prog.s')
+
+
+def test_output_through_symlink_updates_its_target(tmp_path, assemble):
+    target = tmp_path / 'target.mif'
+    target.write_text('stale')
+    os.symlink(str(target), str(tmp_path / 'prog.mif'))
+
+    assemble()
+
+    assert os.path.islink(str(tmp_path / 'prog.mif'))
+    assert 'mvt  r3, #0x1000' in target.read_text()
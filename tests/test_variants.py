@@ -0,0 +1,105 @@
+import pytest
+
+from Assembler import Assembler
+
+
+# Two defines, one depending on the other, and an instruction that uses neither
+VARIANT_SOURCE = """.define A 0x1000
+.define B A + 1
+		mv    r0, #A
+		mv    r1, #B
+		mv    r2, #3
+"""
+
+
+@pytest.fixture
+def assemble_variants(tmp_path, write_source):
+    """
+    Returns a function that assembles a source file into prog_<name>.mif for each of the
+    given variant strings.
+    """
+    def assemble_variants(variants, source=VARIANT_SOURCE):
+        source_path = write_source(source)
+        Assembler(str(source_path), str(tmp_path / 'prog.mif')).assemble_variants(
+            [Assembler.parse_variant(variant) for variant in variants])
+
+    return assemble_variants
+
+
+def test_variants_fix_out_of_range_defines(tmp_path, capsys, assemble_variants):
+    assemble_variants(['v: A=1', 'w: A=2, B=5', 'base:'])
+
+    assert 'mv   r0, #0x0001' in (tmp_path / 'prog_v.mif').read_text()
+    assert 'mv   r1, #0x0002' in (tmp_path / 'prog_v.mif').read_text()
+    assert 'mv   r1, #0x0005' in (tmp_path / 'prog_w.mif').read_text()
+    assert not (tmp_path / 'prog_base.mif').exists()
+    assert not (tmp_path / 'prog.mif').exists()
+    assert capsys.readouterr().out == 'Variant base: ERROR: line 3: the immediate value is too large\n'
+
+
+def test_variant_errors_are_reported_separately(tmp_path, capsys, assemble_variants):
+    assemble_variants(['big: A=0x200', 'ok: A=0x10', 'nodef: C=1'])
+
+    assert (tmp_path / 'prog_ok.mif').exists()
+    assert capsys.readouterr().out.splitlines() == [
+        'Variant big: ERROR: line 3: the immediate value is too large',
+        'Variant nodef: ERROR: only .define symbols and DEPTH can be overridden']
+
+
+def test_depth_override_checks_branches_again(tmp_path, capsys, assemble_variants):
+    assemble_variants(['small: DEPTH=4', 'large: DEPTH=512'], 
+        '\t\tmv    r0, #1\n'
+        '\t\tmv    r1, #2\n'
+        '\t\tmv    r2, #3\n'
+        '\t\tmv    r3, #4\n'
+        'END:\tb     #END\n')
+
+    assert capsys.readouterr().out == (
+        'Variant small: ERROR: line 5: the branch target is too large\n')
+    assert not (tmp_path / 'prog_small.mif').exists()
+    assert 'DEPTH = 512;' in (tmp_path / 'prog_large.mif').read_text()
+    assert 'b    #0x0004' in (tmp_path / 'prog_large.mif').read_text()
+
+
+def test_only_instructions_using_overrides_are_encoded_again(tmp_path, monkeypatch, 
+        assemble_variants):
+    encoded_imms = []
+    encode = Assembler._Assembler__encode_type2_instruction
+
+    def counting_encode(self, instr, ra, expr):
+        encoded_imms.append(expr.text)
+        return encode(self, instr, ra, expr)
+
+    monkeypatch.setattr(Assembler, '_Assembler__encode_type2_instruction', counting_encode)
+    assemble_variants(['v: A=1'], VARIANT_SOURCE.replace('0x1000', '0x10'))
+
+    # Each immediate is encoded once for the base assembly, then A and B again for v
+    assert encoded_imms == ['A', 'B', '3', 'A', 'B']
+    assert 'mv   r2, #0x0003' in (tmp_path / 'prog_v.mif').read_text()
+
+
+def test_variant_file_skips_comments_and_is_a_dependency(tmp_path, write_source):
+    variant_file = tmp_path / 'boards.txt'
+    variant_file.write_text('// boards\n'
+        '\n'
+        'de1: A=1       // first board\n'
+        '   \n'
+        'de10: A=2, B=3\n')
+    dep = tmp_path / 'prog.d'
+    a = Assembler(str(write_source(VARIANT_SOURCE)), str(tmp_path / 'prog.mif'), 
+        dep_filename=str(dep))
+
+    variants = a.read_variant_file(str(variant_file))
+    a.assemble_variants(variants)
+
+    assert variants == [('de1', {'A': '1'}), ('de10', {'A': '2', 'B': '3'})]
+    assert dep.read_text().splitlines()[0] == (str(tmp_path / 'prog_de1.mif') + ' ' + 
+        str(tmp_path / 'prog_de10.mif') + ': ' + str(tmp_path / 'prog.s') + ' ' + 
+        str(variant_file))
+
+
+def test_duplicate_variant_names_are_an_error(tmp_path, capsys, assemble_variants):
+    assemble_variants(['v: A=1', 'w: A=2', 'v: A=3'])
+
+    assert capsys.readouterr().out == 'ERROR: variant v is defined more than once\n'
+    assert list(tmp_path.glob('prog_*.mif')) == []